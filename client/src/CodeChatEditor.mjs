@@ -22,7 +22,14 @@
 "use strict";
 
 import { ace, on_dom_content_loaded } from "./CodeChat-editor.mjs";
-import { html_beautify } from "js-beautify";
+
+// <p>The <a href="https://github.com/beautify-web/js-beautify">js-beautify</a>
+//     HTML formatter. It's only needed when saving, so <a
+//         href="#on_save"><code>on_save</code></a> loads it on first use,
+//     rather than initializing it on every page load. The bundle isn't split
+//     into chunks: chunk names change with each build, but the server only
+//     serves static files which existed when it started.</p>
+let html_beautify;
 
 // <p>Emulate an enum. <a
 //         href="https://www.30secondsofcode.org/articles/s/javascript-enum">This</a>
@@ -187,22 +194,17 @@ const open_lp = (source_code, extension, mode) => {
     // <p>See if the first line of the file specifies a lexer.</p>
     const m = source_code.match(/^.*CodeChat-lexer:\s*(\w+)/);
     const lexer_name = m ? m[1] : "";
-    let found = false;
-    for (current_language_lexer of language_lexers) {
-        // <p>If the source code provided a lexer name, match only on that;
-        //     otherwise, match based on file extension.</p>
-        if (
-            current_language_lexer[0] === lexer_name ||
-            (!lexer_name && current_language_lexer[1].includes(extension))
-        ) {
-            found = true;
-            break;
-        }
-    }
+    // <p>If the source code provided a lexer name, match only on that;
+    //     otherwise, match based on file extension.</p>
+    const lexer = lexer_name
+        ? language_lexers_by_name.get(lexer_name)
+        : language_lexers_by_extension.get(extension);
     console.assert(
-        found,
+        lexer,
         "Unable to determine which lexer to use for this language."
     );
+    // <p>If nothing matched, treat this as a CodeChat Editor document.</p>
+    current_language_lexer = lexer ?? language_lexers.at(-1);
     // <p>Special case: a CodeChat Editor document's HTML doesn't need lexing.
     // </p>
     let html;
@@ -228,8 +230,18 @@ export const on_save_as = async (on_save_func) => {
     throw msg;
 };
 
-// <p>Save CodeChat Editor contents.</p>
+// <p><a id="on_save"></a>Save CodeChat Editor contents.</p>
 export const on_save = async () => {
+    if (!html_beautify) {
+        try {
+            html_beautify = (await import("js-beautify")).html_beautify;
+        } catch (error) {
+            window.alert(
+                `Save failed -- unable to load js-beautify: ${error}.`
+            );
+            return;
+        }
+    }
     // <p>Pick an inline comment from the current lexer. TODO: support block
     //     comments (CSS, for example, doesn't allow inline comment).</p>
     const inline_comment = current_language_lexer[2][0];
@@ -330,9 +342,26 @@ const language_lexers = [
     ["codechat-html", [".cchtml"],      [""],   [],                 [],             [],         [],     0],
 ];
 
+// <p>Index the lexers by name and by file extension, so that finding the lexer
+//     for a file is a lookup rather than a search. When several lexers share
+//     an extension (<code>.v</code>, for example), the first one listed
+//     wins.</p>
+const language_lexers_by_name = new Map();
+const language_lexers_by_extension = new Map();
+for (const language_lexer of language_lexers) {
+    language_lexers_by_name.set(language_lexer[0], language_lexer);
+    for (const extension of language_lexer[1]) {
+        if (!language_lexers_by_extension.has(extension)) {
+            language_lexers_by_extension.set(extension, language_lexer);
+        }
+    }
+}
+
 // <h2>Source lexer</h2>
 // <p>This lexer categorizes source code into code blocks or doc blocks.&nbsp;It
-//     returns a list of <code>indent, string, indent_type</code> where:</p>
+//     is a generator, yielding <code>indent, string, indent_type</code> for
+//     each block as it's found rather than building a list of the entire
+//     file, where:</p>
 // <dl>
 //     <dt><code>indent</code></dt>
 //     <dd>The indent of a doc block (a string of whitespace), or
@@ -343,7 +372,7 @@ const language_lexers = [
 //     <dt><code>indent_type</code></dt>
 //     <dd>The comment string for a doc block, or "" for a code block.</dd>
 // </dl>
-const source_lexer = (
+const source_lexer = function* (
     // <p>The source code to lex.</p>
     source_code,
     // <p>The following parameters are sequential entries from one element of
@@ -356,7 +385,7 @@ const source_lexer = (
     short_string_strings,
     here_text_strings,
     template_literals
-) => {
+) {
     // <p>Rather than attempt to lex the entire language, this lexer's only goal
     //     is to categorize all the source code into code blocks or doc blocks.
     //     To do it, it only needs to:</p>
@@ -390,54 +419,22 @@ const source_lexer = (
     //     its purpose is to identify the start of the next special case.
     //     <strong>This code makes heavy use of regexes -- read the previous
     //         link thoroughly.</strong></p>
-    // <p>Use an index, since we need to know which special case (a string,
-    //     inline comment, etc.) the regex found.</p>
-    let regex_index = 1;
-    // <p>Produce the overall regex from regexes which find a specific special
-    //     case.</p>
-    let regex_strings = [];
-    // <p>Given an array of strings containing unescaped characters which
-    //     identifies the start of one of the special cases, combine them into a
-    //     single string separated by an or operator. Return the index of the
-    //     resulting string in <code>regex_strings</code>, or <code>null</code>
-    //     if the array is empty (indicating that this language doesn't support
-    //     the provided special case).</p>
-    const regex_builder = (strings) => {
-        // <p>Look for a non-empty array. Note that <code>[]</code> is
-        //     <code>true</code>.</p>
-        if (strings.length) {
-            regex_strings.push(
-                // <p>Escape any regex characters in these strings.</p>
-                strings.map(escapeRegExp).join("|")
-            );
-            return regex_index++;
-        }
-        return null;
-    };
-    // <p>Order these statements by length of the expected strings, since the
-    //     regex with an or expression will match left to right.</p>
-    // <p>Include only the opening block comment string (element 0) in the
-    //     regex.</p>
-    let block_comment_index = regex_builder(
-        block_comment_strings.map((element) => element[0])
+    const [
+        classify_regex,
+        block_comment_index,
+        long_string_index,
+        inline_comment_index,
+        short_string_index,
+        template_literal_index,
+    ] = get_classify_regex(
+        language_name,
+        inline_comment_strings,
+        block_comment_strings,
+        long_string_strings,
+        short_string_strings,
+        template_literals
     );
-    let long_string_index = regex_builder(long_string_strings);
-    let inline_comment_index = regex_builder(inline_comment_strings);
-    let short_string_index = regex_builder(short_string_strings);
-    // <p>Template literals only exist in JavaScript. No other language (that I
-    //     know of) allows comments inside these, or nesting of template
-    //     literals.</p>
-    let template_literal_index = null;
-    if (template_literals) {
-        // <p>If inside a template literal, look for a nested template literal
-        //     (<code>`</code>) or the end of the current expression
-        //     (<code>}</code>).</p>
-        regex_strings.push(template_literals === 1 ? "`" : "`|}");
-        template_literal_index = regex_index++;
-    }
-    let classify_regex = new RegExp("(" + regex_strings.join(")|(") + ")");
 
-    let classified_source = [];
     // <p>An accumulating array of strings composing the current code block.</p>
     let code_block_array = [];
     while (source_code.length) {
@@ -513,9 +510,7 @@ const source_lexer = (
                 //     delimiter. Therefore, we only need to examine its last
                 //     line.</p>
                 let code_block = code_block_array.join("");
-                const last_line_until_comment = code_block
-                    .split(/\n|\r\n|\r/)
-                    .at(-1);
+                const last_line_until_comment = last_line(code_block);
                 // <p>With this last line located, apply the doc block criteria.
                 // </p>
                 const inline_comment_string = m[inline_comment_index];
@@ -537,7 +532,7 @@ const source_lexer = (
                     );
                     if (code_block) {
                         // <p>Save only code blocks with some content.</p>
-                        classified_source.push([null, code_block, ""]);
+                        yield [null, code_block, ""];
                     }
                     code_block_array = [];
                     // <p>Add this doc block by pushing the array [whitespace
@@ -551,14 +546,14 @@ const source_lexer = (
                     //     newline or an EOF).</p>
                     const has_space_after_comment =
                         full_comment[inline_comment_string.length] === " ";
-                    classified_source.push([
+                    yield [
                         last_line_until_comment,
                         full_comment.substring(
                             inline_comment_string.length +
                                 (has_space_after_comment ? 1 : 0)
                         ),
                         inline_comment_string,
-                    ]);
+                    ];
                 } else {
                     // <p>This is still code.</p>
                     code_block_array.push(full_comment);
@@ -591,9 +586,7 @@ const source_lexer = (
                 source_code = source_code.substring(full_comment.length);
 
                 let code_block = code_block_array.join("");
-                const last_line_until_comment = code_block
-                    .split(/\n|\r\n|\r/)
-                    .at(-1);
+                const last_line_until_comment = last_line(code_block);
                 // <p>With this last line located, apply the doc block criteria.
                 // </p>
                 const block_comment_string = m[block_comment_index];
@@ -626,13 +619,13 @@ const source_lexer = (
                     );
                     if (code_block) {
                         // <p>Save only code blocks with some content.</p>
-                        classified_source.push([null, code_block, ""]);
+                        yield [null, code_block, ""];
                     }
                     code_block_array = [];
                     const has_space_after_comment =
                         full_comment[block_comment_string.length] === " ";
                     // <p>don't add the closing */ to the comment</p>
-                    classified_source.push([
+                    yield [
                         last_line_until_comment,
                         full_comment.substring(
                             block_comment_string.length +
@@ -640,7 +633,7 @@ const source_lexer = (
                             full_comment.length - 2
                         ),
                         block_comment_string,
-                    ]);
+                    ];
                 } else {
                     // <p>This is still code.</p>
                     code_block_array.push(full_comment);
@@ -675,44 +668,8 @@ const source_lexer = (
                 source_code = source_code.substring(
                     m[short_string_index].length
                 );
-                // prettier-ignore
                 const string_m = source_code.match(
-                    // <p>Use <a
-                    //         href="https://developer.mozilla.org/en-US/docs/Web/JavaScript/Reference/Global_Objects/String/raw"><code>String.raw</code></a>
-                    //     so we don't have to double the number of backslashes
-                    //     in this regex. Joining regex literals doesn't work
-                    //     &ndash; <code>/.a/ +
-                    //         /b/</code> produces the string
-                    //     <code>'/.a//b/'</code>, not a regex. The regex is:
-                    // </p>
-                    // <p>Look for anything that doesn't terminate a string:</p>
-                    "(" +
-                        // <p>a backslash followed by a newline (in all three
-                        //     newline styles);</p>
-                        String.raw`\\\r\n|\\\n|\\\r|` +
-                        // <p>a backslash followed by any non-newline character
-                        //     (note that the <code>.</code> character class <a
-                        //         href="https://developer.mozilla.org/en-US/docs/Web/JavaScript/Guide/Regular_Expressions/Character_Classes#types">doesn't
-                        //         match newlines</a>; using the <code>s</code>
-                        //     or <code>dotAll</code> flag causes it to match <a
-                        //         href="https://developer.mozilla.org/en-US/docs/Web/JavaScript/Reference/Lexical_grammar#line_terminators">line
-                        //         terminators</a> that we don't recognize, plus
-                        //     not match a <code>\r\n</code> sequence);</p>
-                        String.raw`\\.|` +
-                        // <p>anything that's not a backslash, quote mark, or
-                        //     newline.</p>
-                        String.raw`[^\\${m[short_string_index]}\n\r]` +
-                        // <p>Find as many of these as possible. Therefore, the
-                        //     next token will be the end of the string.</p>
-                    ")*" +
-                    // <p>A string is terminated by either a quote mark or a
-                    //     newline. (We can't just put <code>.</code>, because
-                    //     one flavor of newline is two characters; in addition,
-                    //     that character class doesn't match newlines, as
-                    //     stated above.) Terminating strings at a newline helps
-                    //     avoid miscategorizing large chunks of code that the
-                    //     compiler likewise flags as a syntax error.</p>
-                    String.raw`(${m[short_string_index]}|\r\n|\n|\r)`
+                    get_short_string_regex(m[short_string_index])
                 );
                 if (string_m) {
                     const index = string_m.index + string_m[0].length;
@@ -743,123 +700,252 @@ const source_lexer = (
     // <p>Include any accumulated code in the classification.</p>
     const code = code_block_array.join("");
     if (code) {
-        classified_source.push([null, code, ""]);
+        yield [null, code, ""];
+    }
+};
+
+// <h3>get_classify_regex</h3>
+// <p>Construct the <code>classify_regex</code> used by the <a
+//         href="#source_lexer">source lexer</a>, along with the index of the
+//     match group for each special case. This depends only on the language, so
+//     cache the results rather than rebuilding and recompiling the regex each
+//     time a file is lexed.</p>
+const classify_regex_cache = new Map();
+const get_classify_regex = (
+    // <p>These parameters are the corresponding parameters passed to the
+    //     source lexer.</p>
+    language_name,
+    inline_comment_strings,
+    block_comment_strings,
+    long_string_strings,
+    short_string_strings,
+    template_literals
+) => {
+    // <p>The template literal parameter changes the regex, so include it in
+    //     the key.</p>
+    const cache_key = `${language_name} ${template_literals}`;
+    const cached = classify_regex_cache.get(cache_key);
+    if (cached) {
+        return cached;
+    }
+
+    // <p>Use an index, since we need to know which special case (a string,
+    //     inline comment, etc.) the regex found.</p>
+    let regex_index = 1;
+    // <p>Produce the overall regex from regexes which find a specific special
+    //     case.</p>
+    let regex_strings = [];
+    // <p>Given an array of strings containing unescaped characters which
+    //     identifies the start of one of the special cases, combine them into a
+    //     single string separated by an or operator. Return the index of the
+    //     resulting string in <code>regex_strings</code>, or <code>null</code>
+    //     if the array is empty (indicating that this language doesn't support
+    //     the provided special case).</p>
+    const regex_builder = (strings) => {
+        // <p>Look for a non-empty array. Note that <code>[]</code> is
+        //     <code>true</code>.</p>
+        if (strings.length) {
+            regex_strings.push(
+                // <p>Escape any regex characters in these strings.</p>
+                strings.map(escapeRegExp).join("|")
+            );
+            return regex_index++;
+        }
+        return null;
+    };
+    // <p>Order these statements by length of the expected strings, since the
+    //     regex with an or expression will match left to right.</p>
+    // <p>Include only the opening block comment string (element 0) in the
+    //     regex.</p>
+    let block_comment_index = regex_builder(
+        block_comment_strings.map((element) => element[0])
+    );
+    let long_string_index = regex_builder(long_string_strings);
+    let inline_comment_index = regex_builder(inline_comment_strings);
+    let short_string_index = regex_builder(short_string_strings);
+    // <p>Template literals only exist in JavaScript. No other language (that I
+    //     know of) allows comments inside these, or nesting of template
+    //     literals.</p>
+    let template_literal_index = null;
+    if (template_literals) {
+        // <p>If inside a template literal, look for a nested template literal
+        //     (<code>`</code>) or the end of the current expression
+        //     (<code>}</code>).</p>
+        regex_strings.push(template_literals === 1 ? "`" : "`|}");
+        template_literal_index = regex_index++;
     }
+    const classify_regex = new RegExp("(" + regex_strings.join(")|(") + ")");
+
+    const result = [
+        classify_regex,
+        block_comment_index,
+        long_string_index,
+        inline_comment_index,
+        short_string_index,
+        template_literal_index,
+    ];
+    classify_regex_cache.set(cache_key, result);
+    return result;
+};
 
-    return classified_source;
+// <h3>get_short_string_regex</h3>
+// <p>Return a regex which finds the end of a short string opened by the quote
+//     mark <code>quote</code>. There are only a few distinct quote marks, so
+//     cache these rather than building a new regex for every string the <a
+//         href="#source_lexer">source lexer</a> finds.</p>
+const short_string_regex_cache = new Map();
+const get_short_string_regex = (quote) => {
+    let short_string_regex = short_string_regex_cache.get(quote);
+    if (!short_string_regex) {
+        // prettier-ignore
+        short_string_regex = new RegExp(
+            // <p>Use <a
+            //         href="https://developer.mozilla.org/en-US/docs/Web/JavaScript/Reference/Global_Objects/String/raw"><code>String.raw</code></a>
+            //     so we don't have to double the number of backslashes
+            //     in this regex. Joining regex literals doesn't work
+            //     &ndash; <code>/.a/ +
+            //         /b/</code> produces the string
+            //     <code>'/.a//b/'</code>, not a regex. The regex is:
+            // </p>
+            // <p>Look for anything that doesn't terminate a string:</p>
+            "(" +
+                // <p>a backslash followed by a newline (in all three
+                //     newline styles);</p>
+                String.raw`\\\r\n|\\\n|\\\r|` +
+                // <p>a backslash followed by any non-newline character
+                //     (note that the <code>.</code> character class <a
+                //         href="https://developer.mozilla.org/en-US/docs/Web/JavaScript/Guide/Regular_Expressions/Character_Classes#types">doesn't
+                //         match newlines</a>; using the <code>s</code>
+                //     or <code>dotAll</code> flag causes it to match <a
+                //         href="https://developer.mozilla.org/en-US/docs/Web/JavaScript/Reference/Lexical_grammar#line_terminators">line
+                //         terminators</a> that we don't recognize, plus
+                //     not match a <code>\r\n</code> sequence);</p>
+                String.raw`\\.|` +
+                // <p>anything that's not a backslash, quote mark, or
+                //     newline.</p>
+                String.raw`[^\\${quote}\n\r]` +
+                // <p>Find as many of these as possible. Therefore, the
+                //     next token will be the end of the string.</p>
+            ")*" +
+            // <p>A string is terminated by either a quote mark or a
+            //     newline. (We can't just put <code>.</code>, because
+            //     one flavor of newline is two characters; in addition,
+            //     that character class doesn't match newlines, as
+            //     stated above.) Terminating strings at a newline helps
+            //     avoid miscategorizing large chunks of code that the
+            //     compiler likewise flags as a syntax error.</p>
+            String.raw`(${quote}|\r\n|\n|\r)`
+        );
+        short_string_regex_cache.set(quote, short_string_regex);
+    }
+    return short_string_regex;
 };
 
 // <h2 id="classified_source_to_html">Convert lexed code into HTML</h2>
+// <p>The fixed HTML which surrounds each code and doc block. These are built
+//     once here, rather than each time a block is entered or exited.</p>
+// <p>A code block is placed in an ACE editor; its first line number goes
+//     between the two opening strings.</p>
+const code_block_open_start = `
+<div class="CodeChat-code">
+    <div class="CodeChat-ACE" data-CodeChat-firstLineNumber="`;
+const code_block_open_end = `">`;
+const code_block_close = "</div>\n</div>\n";
+// <p>A doc block is placed in a TinyMCE editor; its indent goes between the two
+//     opening strings. The closing string doesn't add any trailing spaces
+//     &mdash; combining this with the next line would add indentation.</p>
+const doc_block_open_start = `<div class="CodeChat-doc">
+    <table>
+        <tbody>
+            <tr>
+                <!-- Spaces matching the number of digits in the ACE gutter's line number. TODO: fix this to match the number of digits of the last line of the last code block. Fix ACE to display this number of digits in all gutters. See https://stackoverflow.com/questions/56601362/manually-change-ace-line-numbers. -->
+                <td class="CodeChat-ACE-gutter-padding ace_editor">&nbsp;&nbsp;&nbsp</td>
+                <td class="CodeChat-ACE-padding"></td>
+                <!-- This doc block's indent. TODO: allow paste, but must only allow pasting spaces. -->
+                <td class="ace_editor CodeChat-doc-indent" contenteditable onpaste="return false">`;
+const doc_block_open_end = `</td>
+                <td class="CodeChat-TinyMCE-td"><div class="CodeChat-TinyMCE">`;
+const doc_block_close = `</td>
+            </tr>
+        </tbody>
+    </table>
+</div>
+`;
+
 const classified_source_to_html = (classified_source) => {
     // <p>An array of strings for the new content of the current HTML page.</p>
     let html = [];
 
-    // <p>Keep track of the current type. Begin with neither comment nor code.
-    // </p>
-    let current_indent = -2;
-
     // <p>Keep track of the current line number.</p>
     let line = 1;
 
-    for (let [indent, source_string, comment_string] of classified_source) {
+    // <p>Emit the HTML for a block: a run of classified lines with the same
+    //     indent, passed as the single string <code>source_string</code>.
+    //     Since this is the entire block, emit its opening, contents, and
+    //     closing together; there's no need to track the current state in
+    //     order to close it later.</p>
+    const block_to_html = (indent, source_string) => {
         // <p><span id="newline-movement">In a code or doc block, omit the last
         //         newline; otherwise, code blocks would show an extra newline
         //         at the end of the block. (Doc blocks ending in a
         //         <code>&lt;pre&gt;</code> tag or something similar would also
-        //         have this problem). To do this, remove the newline from the
-        //         end of the current line, then prepend it to the beginning of
-        //         the next line.</span></p>
-        const m = source_string.match(/(\n|\r\n|\r)$/);
-        if (m) {
-            source_string = source_string.substring(0, m.index);
-        }
-
-        // <p>See if there's a change in state.</p>
-        if (current_indent !== indent) {
-            // <p>Exit the current state.</p>
-            _exit_state(current_indent, html);
+        //         have this problem).</span></p>
+        source_string = source_string.substring(
+            0,
+            source_string.length - trailing_newline_length(source_string)
+        );
 
-            // <p>Enter the new state.</p>
-            if (indent === null) {
-                // <p>Code state: emit the beginning of an ACE editor block.</p>
-                html.push(
-                    `
-<div class="CodeChat-code">
-    <div class="CodeChat-ACE" data-CodeChat-firstLineNumber="${line}">`,
-                    escapeHTML(source_string)
-                );
-            } else {
-                // <p>Comment state: emit an opening indent for non-zero
-                //     indents; insert a TinyMCE editor.</p>
-                // <p><span id="one-row-table">Use a one-row table to lay out a
-                //         doc block, so that it aligns properly with a code
-                //         block.</span></p>
-                html.push(
-                    `<div class="CodeChat-doc">
-    <table>
-        <tbody>
-            <tr>
-                <!-- Spaces matching the number of digits in the ACE gutter's line number. TODO: fix this to match the number of digits of the last line of the last code block. Fix ACE to display this number of digits in all gutters. See https://stackoverflow.com/questions/56601362/manually-change-ace-line-numbers. -->
-                <td class="CodeChat-ACE-gutter-padding ace_editor">&nbsp;&nbsp;&nbsp</td>
-                <td class="CodeChat-ACE-padding"></td>
-                <!-- This doc block's indent. TODO: allow paste, but must only allow pasting spaces. -->
-                <td class="ace_editor CodeChat-doc-indent" contenteditable onpaste="return false">${indent}</td>
-                <td class="CodeChat-TinyMCE-td"><div class="CodeChat-TinyMCE">`,
-                    source_string
-                );
-            }
+        if (indent === null) {
+            // <p>Code block: place this in an ACE editor.</p>
+            html.push(
+                code_block_open_start,
+                line,
+                code_block_open_end,
+                escapeHTML(source_string),
+                code_block_close
+            );
         } else {
-            // <p><span id="newline-prepend"><a href="#newline-movement">Newline
-            //             movement</a>: prepend the newline removed from the
-            //         previous line to the current line</span>.</p>
+            // <p>Doc block: emit an opening indent for non-zero indents;
+            //     insert a TinyMCE editor.</p>
+            // <p><span id="one-row-table">Use a one-row table to lay out a doc
+            //         block, so that it aligns properly with a code
+            //         block.</span></p>
             html.push(
-                m[0],
-                indent === null ? escapeHTML(source_string) : source_string
+                doc_block_open_start,
+                indent,
+                doc_block_open_end,
+                source_string,
+                doc_block_close
             );
         }
 
-        // <p>Update the state.</p>
-        current_indent = indent;
         // <p>There are an unknown number of newlines in this source string. One
         //     was removed <a href="#newline-movement">here</a>, so include that
         //     in the count.</p>
         line += 1 + (source_string.match(/\n|\r\n|\r/g) || []).length;
+    };
+
+    // <p>The lexer produces a separate entry for each line of a doc block.
+    //     Collect each run of entries with the same indent, then join and
+    //     process the run as a whole, instead of handling newlines, escaping,
+    //     and counting lines one entry at a time.</p>
+    let run_indent = -2;
+    let run = [];
+    for (const [indent, source_string] of classified_source) {
+        if (indent !== run_indent && run.length) {
+            block_to_html(run_indent, run.join(""));
+            run = [];
+        }
+        run_indent = indent;
+        run.push(source_string);
+    }
+    if (run.length) {
+        block_to_html(run_indent, run.join(""));
     }
 
-    // <p>When done, exit the last state.</p>
-    _exit_state(current_indent, html);
     return html.join("");
 };
 
-// <h3>_exit_state</h3>
-// <p>Output text produced when exiting a state. Supports <a
-//         href="#_generate_web_editable"><code>_generate_web_editable</code></a>.
-// </p>
-const _exit_state = (
-    // <p>The type (classification) of the last line.</p>
-    indent,
-    // <p>An array of string to store output in.</p>
-    html
-) => {
-    if (indent === null) {
-        // <p>Close the current code block.</p>
-        html.push("</div>\n</div>\n");
-    } else if (typeof indent === "string") {
-        // <p>Close the current doc block without adding any trailing spaces
-        //     &mdash; combining this with the next line would add indentation.
-        // </p>
-        //</p>
-        html.push(
-            `</td>
-            </tr>
-        </tbody>
-    </table>
-</div>
-`
-        );
-    }
-};
-
 // <h2>Save editor contents to source code</h2>
 // <p>This transforms the current editor contents into source code.</p>
 const editor_to_source_code = (
@@ -869,8 +955,10 @@ const editor_to_source_code = (
     comment_string
 ) => {
     // <p>Walk through each code and doc block, extracting its contents then
-    //     placing it in <code>classified_lines</code>.</p>
-    let classified_lines = [];
+    //     transforming it into source code. Accumulate the pieces of this
+    //     source code in <code>lines</code>, then join them once at the end.
+    // </p>
+    let lines = [];
     for (const code_or_doc_tag of document.querySelectorAll(
         ".CodeChat-ACE, .CodeChat-TinyMCE"
     )) {
@@ -913,24 +1001,16 @@ const editor_to_source_code = (
             );
         }
 
-        // <p>Split the <code>full_string</code> into individual lines; each one
-        //     corresponds to an element of <code>classified_lines</code>.</p>
+        // <p>Each line of a code block is just dumped out! Likewise for a
+        //     CodeChat Editor document, where the indent doesn't matter. Prefix
+        //     each line of a doc block with the indent and the comment string.
+        // </p>
+        // <p>TODO: allow the use of block comments.</p>
+        const prefix = indent === null ? "" : `${indent}${comment_string} `;
+        // <p>Split the <code>full_string</code> into individual lines, then
+        //     add each to the source code.</p>
         for (const string of full_string.split(/\r?\n/)) {
-            classified_lines.push([indent, string + "\n"]);
-        }
-    }
-
-    // <p>Transform these classified lines into source code.</p>
-    let lines = [];
-    for (const [indent, string] of classified_lines) {
-        if (indent === null) {
-            // <p>Just dump code out! Or a CodeChat Editor document, where the
-            //     indent doesn't matter.</p>
-            lines.push(string);
-        } else {
-            // <p>Prefix comments with the indent and the comment string.</p>
-            // <p>TODO: allow the use of block comments.</p>
-            lines.push(`${indent}${comment_string} ${string}`);
+            lines.push(prefix, string, "\n");
         }
     }
 
@@ -952,6 +1032,23 @@ const escapeHTML = (unsafeText) => {
     return unsafeText;
 };
 
+// <p>Return the last line of <code>text</code>: everything after its last
+//     newline (in any of the three newline styles). This avoids splitting all
+//     of <code>text</code> into lines just to examine the final one.</p>
+const last_line = (text) =>
+    text.substring(
+        Math.max(text.lastIndexOf("\n"), text.lastIndexOf("\r")) + 1
+    );
+
+// <p>Return the length of the newline (in any of the three newline styles)
+//     which ends <code>text</code>, or 0 if it doesn't end with a newline.</p>
+const trailing_newline_length = (text) =>
+    text.endsWith("\r\n")
+        ? 2
+        : text.endsWith("\n") || text.endsWith("\r")
+        ? 1
+        : 0;
+
 // <p>This function comes from the <a
 //         href="https://developer.mozilla.org/en-US/docs/Web/JavaScript/Guide/Regular_Expressions#escaping">MDN
 //         docs</a>.</p>
@@ -966,7 +1063,7 @@ const escapeRegExp = (string) =>
 // <p>TODO!</p>
 const test_source_lexer_1 = () => {
     const python_source_lexer = (source_code) =>
-        source_lexer(source_code, ...language_lexers[4]);
+        [...source_lexer(source_code, ...language_lexers[4])];
 
     assert_equals(python_source_lexer(""), []);
     assert_equals(python_source_lexer("\n"), [[null, "\n", ""]]);
@@ -1049,7 +1146,7 @@ const test_source_lexer_1 = () => {
 
 const test_source_lexer_2 = () => {
     const c_cpp_source_lexer = (source_code) =>
-        source_lexer(source_code, ...language_lexers[0]);
+        [...source_lexer(source_code, ...language_lexers[0])];
 
     // <p>TODO: The newline is outside a comment, but should still be considered
     //     a part of the doc block.</p>
@@ -1059,9 +1156,36 @@ const test_source_lexer_2 = () => {
     ]);
 };
 
+// <p>A multi-line doc block ending at the end of the file, with no final
+//     newline, used to crash <code>classified_source_to_html</code>.</p>
+const test_classified_source_to_html = () => {
+    const python_source_to_html = (source_code) =>
+        classified_source_to_html(
+            source_lexer(source_code, ...language_lexers[4])
+        );
+
+    console.assert(
+        python_source_to_html("# a\n# b").includes(
+            '<div class="CodeChat-TinyMCE">a\nb</td>'
+        )
+    );
+    const html = python_source_to_html("  # a\n  #\n  # b");
+    console.assert(
+        html.includes('contenteditable onpaste="return false">  </td>') &&
+            html.includes('<div class="CodeChat-TinyMCE">a\n\nb</td>')
+    );
+    // <p>A code block following the doc block starts on the correct line.</p>
+    console.assert(
+        python_source_to_html("# a\n# b\nx = 1").includes(
+            'data-CodeChat-firstLineNumber="3">x = 1</div>'
+        )
+    );
+};
+
 const test_source_lexer = () => {
     test_source_lexer_1();
     //test_source_lexer_2();
+    test_classified_source_to_html();
 };
 
 // <p>Woefully inadequate, but enough for testing.</p>
@@ -24,14 +24,36 @@
 //     files back to the local filesystem.</p>
 // <h2>Imports</h2>
 import os
+import net.http
 import net.urllib
-import regex
+import strings
+import time
 import vweb
 
 // <h2>Types</h2>
 // <p>This stores web server state.</p>
 struct App {
 	vweb.Context
+mut:
+	// <p>vweb gives each request its own copy of <code>App</code>, but shares
+	//     this cache among all of them.</p>
+	page_cache shared PageCache
+	// <p>When this server started, in seconds since the epoch. Generated pages
+	//     also depend on this server's code, so their ETags include this;
+	//     a rebuilt server never accepts an ETag from an earlier one.</p>
+	server_start i64 [vweb_global]
+}
+
+// <p>Recently generated CodeChat Editor pages, indexed by the path of their
+//     source file followed by their ETag. The ETag is built from the file's
+//     modification time, which is too coarse to tell apart edits made in
+//     quick succession; pages for recently modified files, which have no
+//     ETag, are therefore never cached.</p>
+struct PageCache {
+mut:
+	pages map[string]string
+	// <p>The total length of all cached pages.</p>
+	size int
 }
 
 // <p>This defines the JSON file produced by webpack.</p>
@@ -43,23 +65,132 @@ struct WebpackJson {
 
 // <h2>Constants</h2>
 const (
-	codechat_extensions = [
-		'.c',
-		'.cc',
-		'.cpp',
-		'.html',
-		'.js',
-		'.mjs',
-		'.json',
-		'.py',
-		'.toml',
-		'.ts',
-		'.mts',
-		'.v',
-		'.yaml',
-		'.yml',
-		'.cchtml',
-	]
+	// <p>The port this server listens on.</p>
+	port                = 8080
+	// <p>The maximum total size, in bytes, of the pages in the page cache.</p>
+	page_cache_max_size = 32 * 1024 * 1024
+	// <p>Modification times have a resolution of one second (or two, on some
+	//     filesystems). A file modified within this many seconds of now may
+	//     change again without its modification time changing.</p>
+	racy_mtime_seconds  = 2
+	// <p>Extensions of files which the CodeChat Editor can open. Store these as
+	//     map keys, so that checking an extension is a hash lookup rather than
+	//     a scan of a list.</p>
+	codechat_extensions = {
+		'.c':      true
+		'.cc':     true
+		'.cpp':    true
+		'.html':   true
+		'.js':     true
+		'.mjs':    true
+		'.json':   true
+		'.py':     true
+		'.toml':   true
+		'.ts':     true
+		'.mts':    true
+		'.v':      true
+		'.yaml':   true
+		'.yml':    true
+		'.cchtml': true
+	}
+	// <p>The fixed portions of a table of contents page, split at each point
+	//     where <code>codechat_editor_html</code> inserts per-file content.</p>
+	toc_page_head = '<!DOCTYPE html>
+<html lang="en">
+	<head>
+		<meta charset="UTF-8">
+		<meta name="viewport" content="width=device-width, initial-scale=1">
+		<title>'
+	toc_page_body = ' - The CodeChat Editor</title>
+
+		<link rel="stylesheet" href="/static/css/CodeChatEditor.css">
+		<link rel="stylesheet" href="/static/css/CodeChatEditorSidebar.css">
+		<script>
+			addEventListener("DOMContentLoaded", (event) => {
+				document.querySelectorAll("a").forEach((a_element) => {
+					a_element.target = "_parent"
+				});
+			});
+		</script>
+	</head>
+	<body>
+'
+	toc_page_tail = '
+	</body>
+</html>
+'
+	// <p>The fixed portions of a directory listing, which surround the
+	//     directory's name and its list of entries.</p>
+	dir_listing_head = '<!DOCTYPE html>
+<html lang="en">
+	<head>
+		<meta charset="UTF-8">
+		<meta name="viewport" content="width=device-width, initial-scale=1">
+		<title>The CodeChat Editor</title>
+	</head>
+	<body>
+		<h1>
+			Directory of '
+	dir_listing_list = '
+		</h1>
+		<ul>
+'
+	dir_listing_tail = '        </ul>
+	</body>
+</html>'
+	// <p>Likewise, the fixed portions of a CodeChat Editor page.</p>
+	editor_page_head = '<!DOCTYPE html>
+<html lang="en">
+	<head>
+		<meta charset="UTF-8">
+		<meta name="viewport" content="width=device-width, initial-scale=1">
+		<title>'
+	editor_page_script = ' - The CodeChat Editor</title>
+
+        <link rel="stylesheet" href="/static/webpack/CodeChatEditor.css">
+		<script type="module">
+		    import { page_init, on_keydown, on_save, on_save_as } from "/static/webpack/CodeChatEditor.js"
+			// <p>Make these accesible on the onxxx handlers below. See <a
+			//         href="https://stackoverflow.com/questions/44590393/es6-modules-undefined-onclick-function-after-import">SO</a>.
+			// </p>
+			window.CodeChatEditor = { on_keydown, on_save, on_save_as };
+
+			page_init(
+"'
+	editor_page_ext = '",
+"'
+	editor_page_css = '");
+		</script>
+		<link rel="stylesheet" href="/static/css/CodeChatEditor.css">
+		'
+	editor_page_sidebar = '
+	</head>
+	<body onkeydown="CodeChatEditor.on_keydown(event);">
+		'
+	editor_page_name = '
+		<div id="CodeChat-contents">
+			<div id="CodeChat-top">
+				<div id="CodeChat-filename">
+					<p>
+						<button disabled onclick="CodeChatEditor.on_save_as(on_save_doc);" id="CodeChat-save-as-button">
+							Save as
+						</button>
+						<button onclick="CodeChatEditor.on_save();" id="CodeChat-save-button">
+							<span class="CodeChat-hotkey">S</span>ave
+						</button>
+						- '
+	editor_page_dir = ' - '
+	editor_page_tail = '
+					</p>
+				</div>
+				<div id="CodeChat-menu"></div>
+			</div>
+			<div id="CodeChat-body"></div>
+			<div id="CodeChat-bottom"></div>
+		</div>
+	</body>
+</html>
+'
 )
 
 // <h2>Endpoints</h2>
@@ -76,7 +207,7 @@ fn (mut app App) root_redirect() vweb.Result {
 fn (mut app App) serve_fs_bare() vweb.Result {
 	// <p>On Windows, assume the C drive as the root of the filesystem. TODO:
 	//     provide some way to list drives / change drives from the HTML GUI.</p>
-	if os.user_os() == 'windows' {
+	$if windows {
 		return app.redirect('/fs/${urllib.path_escape('C:')}/')
 	}
 	return app.serve_fs_('/')
@@ -100,7 +231,10 @@ struct ErrorResponse {
 fn (mut app App) save_file(path string) vweb.Result {
 	// <p>For Unix, restore the leading <code>/</code> to the beginning of the
 	//     path.</p>
-	fixed_path := (if os.user_os() != 'windows' { '/' } else { '' }) + path
+	mut fixed_path := path
+	$if !windows {
+		fixed_path = '/' + path
+	}
 	abs_path := os.abs_path(fixed_path)
 	os.write_file(abs_path, app.req.data) or {
 		// <p>TODO: Return an ErrorResponse.</p>
@@ -115,20 +249,19 @@ fn (mut app App) save_file(path string) vweb.Result {
 //     files, or serve a CodeChat Editor file or a normal file.</p>
 fn (mut app App) serve_fs_(path string) vweb.Result {
 	// <p>The provided <code>path</code> may need fixing, since it lacks an initial
-	//     <code>/</code>.</p>
+	//     <code>/</code>. The OS is known at compile time, so use a
+	//     compile-time <code>$if</code> to choose the fix.</p>
 	mut fixed_path := path
-	if os.user_os() == 'windows' {
+	$if windows {
 		// <p>On Windows, a path of <code>drive_letter:</code> needs a <code>/</code>
-		//     appended.</p>
-		mut regex_drive_letter := regex.regex_opt('^[a-zA-Z]:$') or {
-			panic('Regex failed to compile.')
-		}
-		if regex_drive_letter.matches_string(path) {
+		//     appended. Check for this directly, rather than compiling a regex
+		//     on every request.</p>
+		if path.len == 2 && path[0].is_letter() && path[1] == `:` {
 			fixed_path += '/'
 		}
 		// <p>All other cases (for example, <code>C:\a\path\to\file.txt</code>) are
 		//     OK.</p>
-	} else {
+	} $else {
 		// <p>For Linux/OS X, prepend a slash, so that <code>a/path/to/file.txt</code>
 		//     becomes <code>/a/path/to/file.txt</code>.</p>
 		fixed_path = '/' + fixed_path
@@ -138,70 +271,113 @@ fn (mut app App) serve_fs_(path string) vweb.Result {
 
 	if os.is_dir(abs_path) {
 		// <p>Serve a listing of the files and subdirectories in this directory.
-		//     Create the text of a web page with this listing.</p>
-		mut ret := '<!DOCTYPE html>
-<html lang="en">
-	<head>
-		<meta charset="UTF-8">
-		<meta name="viewport" content="width=device-width, initial-scale=1">
-		<title>The CodeChat Editor</title>
-	</head>
-	<body>
-		<h1>
-			Directory of $abs_path
-		</h1>
-		<ul>
-'
+		//     Create the text of a web page with this listing, appending to a
+		//     buffer rather than repeatedly concatenating strings, which would
+		//     copy the entire page for each entry.</p>
+		mut listing := strings.new_builder(4096)
+		listing.write_string(dir_listing_head)
+		listing.write_string(escape_html(abs_path))
+		listing.write_string(dir_listing_list)
 
 		// <p>List each file/directory with appropriate links.</p>
-		mut ls := os.ls(abs_path) or {
-			ret += "<p>But it's not valid.</p>"
+		ls := os.ls(abs_path) or {
+			listing.write_string("<p>But it's not valid.</p>")
 			[]
 		}
-		// <p>Sort it case-insensitively; put directoris before files.</p>
-		ls.sort_with_compare(fn [abs_path] (a &string, b &string) int {
-			// <p>If both a and b aren't directories, sort on that basis.</p>
-			a_is_dir := os.is_dir(os.join_path(abs_path, *a))
-			b_is_dir := os.is_dir(os.join_path(abs_path, *b))
-			if a_is_dir != b_is_dir {
-				return if a_is_dir { -1 } else { 1 }
-			}
-			// <p>Otherwise, sort on the name.</p>
-			return compare_strings(a.to_lower(), b.to_lower())
-		})
-		// <p>Write out HTML for each file/directory.</p>
+		// <p>Split the entries into subdirectories and files in a single pass.
+		//     This requires only one <code>stat</code> system call per entry;
+		//     sorting then compares only names.</p>
+		mut dirs := []string{}
+		mut files := []string{}
 		for f in ls {
-			full_path := os.join_path(abs_path, f)
-			if os.is_dir(full_path) {
-				// <p>Use an absolute path, instead of a relative path, in case the URL of
-				//     this directory doesn't end with a <code>/</code>. Detecting this case
-				//     is hard, since vweb removes the trailing <code>/</code> even if it's
-				//     there!</p>
-				ret += '<li><a href="/fs/$path/${urllib.path_escape(f)}/">$f/</a></li>\n'
+			if os.is_dir(os.join_path(abs_path, f)) {
+				dirs << f
 			} else {
-				extension := os.file_ext(f)
-				html_path := '/fs/$path/${urllib.path_escape(f)}'
-				// <p>See if it's a CodeChat Editor file.</p>
-				if extension in codechat_extensions {
-					// <p>Yes. Provide a link to the CodeChat Editor for this file.</p>
-					ret += '<li><a href="$html_path" target="_blank">$f</a></li>\n'
-				} else {
-					// <p>No. Only list the file, but don't link to it.</p>
-					ret += '<li>$f</li>\n'
-				}
+				files << f
 			}
 		}
-		return app.html(ret + '        </ul>
-	</body>
-</html>')
+		// <p>Sort each case-insensitively; put directoris before files.</p>
+		dirs.sort_with_compare(compare_strings_ignore_case)
+		files.sort_with_compare(compare_strings_ignore_case)
+		// <p>All links share this prefix; build it once. Since it's placed in
+		//     an attribute, escape it (and the rest of each link) as HTML.</p>
+		url_prefix := escape_html('/fs/$path/')
+		// <p>Write out HTML for each directory.</p>
+		for f in dirs {
+			// <p>Use an absolute path, instead of a relative path, in case the URL of
+			//     this directory doesn't end with a <code>/</code>. Detecting this case
+			//     is hard, since vweb removes the trailing <code>/</code> even if it's
+			//     there!</p>
+			listing.write_string('<li><a href="$url_prefix${escape_html(urllib.path_escape(f))}/">${escape_html(f)}/</a></li>\n')
+		}
+		// <p>Write out HTML for each file.</p>
+		for f in files {
+			name := escape_html(f)
+			// <p>See if it's a CodeChat Editor file.</p>
+			if os.file_ext(f) in codechat_extensions {
+				// <p>Yes. Provide a link to the CodeChat Editor for this file.
+				//     Only these files need a URL.</p>
+				listing.write_string('<li><a href="$url_prefix${escape_html(urllib.path_escape(f))}" target="_blank">$name</a></li>\n')
+			} else {
+				// <p>No. Only list the file, but don't link to it.</p>
+				listing.write_string('<li>$name</li>\n')
+			}
+		}
+		listing.write_string(dir_listing_tail)
+		return app.html(listing.str())
 	} else if os.is_file(abs_path) {
 		ext := os.file_ext(abs_path)
 		if ext in codechat_extensions {
+			is_toc := app.query["mode"] == "toc"
+			// <p>A TOC page never shows a sidebar, so it doesn't depend on the
+			//     project.</p>
+			num_dir := if is_toc { -1 } else { find_project(abs_path) }
+			// <p>The generated page depends only on the source file, the mode,
+			//     the location of the project's TOC, and this server's build. If
+			//     the browser already has this version, skip reading and
+			//     transforming the file.</p>
+			etag := file_etag(abs_path, '${app.server_start}-${is_toc}-${num_dir}')
+			if app.not_modified(etag) {
+				return vweb.Result{}
+			}
+			// <p>Likewise, if an earlier request generated this version of the
+			//     page, serve it again. A recently modified file has no ETag,
+			//     since its version can't be identified; don't cache it.</p>
+			cache_key := abs_path + etag
+			if etag != '' {
+				cached_page := rlock app.page_cache {
+					app.page_cache.pages[cache_key] or { '' }
+				}
+				if cached_page != '' {
+					return app.html(cached_page)
+				}
+			}
 			codechat_file_contents := os.read_file(abs_path) or { return app.not_found() }
 			// <p>Transform this into a CodeChat Editor webpage.</p>
-			return app.html(codechat_editor_html(codechat_file_contents, abs_path, app.query["mode"] == "toc"))
+			page := codechat_editor_html(codechat_file_contents, abs_path, is_toc, num_dir)
+			if etag != '' && page.len <= page_cache_max_size {
+				lock app.page_cache {
+					// <p>Bound the memory used by the cache by emptying it when
+					//     it's full.</p>
+					if app.page_cache.size + page.len > page_cache_max_size {
+						app.page_cache.pages = map[string]string{}
+						app.page_cache.size = 0
+					}
+					if cache_key !in app.page_cache.pages {
+						app.page_cache.pages[cache_key] = page
+						app.page_cache.size += page.len
+					}
+				}
+			}
+			return app.html(page)
+		}
+		// <p>It's not a CodeChat Editor file -- just serve the file. vweb reads
+		//     the entire file into memory then copies it to the connection, so
+		//     skip this when the browser already has a current copy (images in a
+		//     doc block, for example, are requested every time a page loads).</p>
+		if app.not_modified(file_etag(abs_path, 'file')) {
+			return vweb.Result{}
 		}
-		// <p>It's not a CodeChat Editor file -- just serve the file.</p>
 		return app.file(abs_path)
 	} else {
 		return app.not_found()
@@ -210,10 +386,10 @@ fn (mut app App) serve_fs_(path string) vweb.Result {
 
 // <h2>CodeChat Editor support</h2>
 // <p>Given the source code for a file and its path, return the HTML to present
-//     this in the CodeChat Editor.</p>
-fn codechat_editor_html(source_code string, path string, is_toc bool) string {
-    mut raw_dir := os.dir(path)
-	dir := escape_html(raw_dir)
+//     this in the CodeChat Editor. <code>num_dir</code> is the result of
+//     calling <code>find_project</code> on <code>path</code>.</p>
+fn codechat_editor_html(source_code string, path string, is_toc bool, num_dir int) string {
+	dir := escape_html(os.dir(path))
 	name := escape_html(os.base(path))
 	ext := os.file_ext(path)
 
@@ -221,33 +397,57 @@ fn codechat_editor_html(source_code string, path string, is_toc bool) string {
 	//     script ensures that all hyperlinks target the enclosing page, not just
 	//     the iframe containing this page.</p>
 	if is_toc {
-		return '<!DOCTYPE html>
-<html lang="en">
-	<head>
-		<meta charset="UTF-8">
-		<meta name="viewport" content="width=device-width, initial-scale=1">
-		<title>$name - The CodeChat Editor</title>
+		mut page := strings.new_builder(toc_page_head.len + name.len + toc_page_body.len +
+			source_code.len + toc_page_tail.len)
+		page.write_string(toc_page_head)
+		page.write_string(name)
+		page.write_string(toc_page_body)
+		page.write_string(source_code)
+		page.write_string(toc_page_tail)
+		return page.str()
+	}
 
-		<link rel="stylesheet" href="/static/css/CodeChatEditor.css">
-		<link rel="stylesheet" href="/static/css/CodeChatEditorSidebar.css">
-		<script>
-			addEventListener("DOMContentLoaded", (event) => {
-				document.querySelectorAll("a").forEach((a_element) => {
-					a_element.target = "_parent"
-				});
-			});
-		</script>
-	</head>
-	<body>
-${source_code}
-	</body>
-</html>
-'
+	sidebar_iframe, sidebar_css := if num_dir >= 0 {
+		'<iframe src="${"../".repeat(num_dir)}toc.cchtml?mode=toc" id="CodeChat-sidebar"></iframe>',
+		'<link rel="stylesheet" href="/static/css/CodeChatEditorProject.css">'
+	} else {
+		"", ""
 	}
 
-    // <p>Look for a project file by searching the current directory, then all
-    //     its parents, for a file named <code>toc.cchtml</code>.</p>
-    mut is_project := false
+	// <p>Write each piece of the page into a buffer allocated once, at its
+	//     final size, rather than copying the (possibly large) source code
+	//     through intermediate strings.</p>
+	quoted_source := quote_string(source_code)
+	quoted_ext := quote_string(ext)
+	mut page := strings.new_builder(editor_page_head.len + 2 * name.len +
+		editor_page_script.len + quoted_source.len + editor_page_ext.len + quoted_ext.len +
+		editor_page_css.len + sidebar_css.len + editor_page_sidebar.len + sidebar_iframe.len +
+		editor_page_name.len + editor_page_dir.len + dir.len + editor_page_tail.len)
+	page.write_string(editor_page_head)
+	page.write_string(name)
+	page.write_string(editor_page_script)
+	page.write_string(quoted_source)
+	page.write_string(editor_page_ext)
+	page.write_string(quoted_ext)
+	page.write_string(editor_page_css)
+	page.write_string(sidebar_css)
+	page.write_string(editor_page_sidebar)
+	page.write_string(sidebar_iframe)
+	page.write_string(editor_page_name)
+	page.write_string(name)
+	page.write_string(editor_page_dir)
+	page.write_string(dir)
+	page.write_string(editor_page_tail)
+	return page.str()
+}
+
+// <p>Look for a project file by searching the directory containing
+//     <code>path</code>, then all its parents, for a file named
+//     <code>toc.cchtml</code>. Return the number of directories between
+//     <code>path</code> and the toc file, or -1 if there's no toc file (this
+//     file isn't part of a project).</p>
+fn find_project(path string) int {
+	mut raw_dir := os.dir(path)
 	// <p>The number of directories between this file to serve (in
 	//     <code>path</code>) and the toc file.</p>
 	mut num_dir := 0
@@ -258,8 +458,7 @@ ${source_code}
 	for (raw_dir != ".") {
 		project_file := os.join_path(raw_dir, "toc.cchtml")
 		if os.is_file(project_file) {
-			is_project = true
-			break
+			return num_dir
 		}
 		// <p>On Linux, we're done if we just checked the root directory.</p>
 		if raw_dir == "/" {
@@ -268,86 +467,151 @@ ${source_code}
 		raw_dir = os.dir(raw_dir)
 		num_dir += 1
 	}
-	sidebar_iframe, sidebar_css := if is_project {
-		'<iframe src="${"../".repeat(num_dir)}toc.cchtml?mode=toc" id="CodeChat-sidebar"></iframe>',
-		'<link rel="stylesheet" href="/static/css/CodeChatEditorProject.css">'
-	} else {
-		"", ""
-	}
-
-	return '<!DOCTYPE html>
-<html lang="en">
-	<head>
-		<meta charset="UTF-8">
-		<meta name="viewport" content="width=device-width, initial-scale=1">
-		<title>$name - The CodeChat Editor</title>
+	return -1
+}
 
-        <link rel="stylesheet" href="/static/webpack/CodeChatEditor.css">
-		<script type="module">
-		    import { page_init, on_keydown, on_save, on_save_as } from "/static/webpack/CodeChatEditor.js"
-			// <p>Make these accesible on the onxxx handlers below. See <a
-			//         href="https://stackoverflow.com/questions/44590393/es6-modules-undefined-onclick-function-after-import">SO</a>.
-			// </p>
-			window.CodeChatEditor = { on_keydown, on_save, on_save_as };
+// <h2>HTTP caching</h2>
+// <p>Return an <a
+//         href="https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/ETag">ETag</a>
+//     identifying the current version of the file at <code>path</code>, based
+//     on its modification time and size. <code>variant</code> distinguishes
+//     between different responses generated from the same file.</p>
+// <p>Two same-size edits within the resolution of the modification time would
+//     produce the same ETag. So, like git's handling of "racily clean" files,
+//     return an empty string (no ETag) for a file modified within
+//     <code>racy_mtime_seconds</code> of now.</p>
+fn file_etag(path string, variant string) string {
+	mtime := os.file_last_mod_unix(path)
+	if mtime >= time.now().unix - racy_mtime_seconds {
+		return ''
+	}
+	return '"${mtime}-${os.file_size(path)}-${variant}"'
+}
 
-			page_init(
-"${quote_script_string(source_code)}",
-"${quote_string(ext)}");
-		</script>
-		<link rel="stylesheet" href="/static/css/CodeChatEditor.css">
-		${sidebar_css}
-	</head>
-	<body onkeydown="CodeChatEditor.on_keydown(event);">
-		${sidebar_iframe}
-		<div id="CodeChat-contents">
-			<div id="CodeChat-top">
-				<div id="CodeChat-filename">
-					<p>
-						<button disabled onclick="CodeChatEditor.on_save_as(on_save_doc);" id="CodeChat-save-as-button">
-							Save as
-						</button>
-						<button onclick="CodeChatEditor.on_save();" id="CodeChat-save-button">
-							<span class="CodeChat-hotkey">S</span>ave
-						</button>
-						- $name - $dir
-					</p>
-				</div>
-				<div id="CodeChat-menu"></div>
-			</div>
-			<div id="CodeChat-body"></div>
-			<div id="CodeChat-bottom"></div>
-		</div>
-	</body>
-</html>
-'
+// <p>Send headers which tell the browser to revalidate its cached copy of this
+//     response before each use, identifying it with <code>etag</code>. If the
+//     browser's copy is already current, send a 304 (Not Modified) response
+//     and return true; the caller must then return without sending anything
+//     else. An empty <code>etag</code> sends no ETag, so the browser's copy is
+//     never current.</p>
+fn (mut app App) not_modified(etag string) bool {
+	app.add_header('Cache-Control', 'no-cache')
+	if etag == '' {
+		return false
+	}
+	app.add_header('ETag', etag)
+	if_none_match := app.req.header.get(.if_none_match) or { '' }
+	if if_none_match != etag {
+		return false
+	}
+	// <p>vweb's response functions always add <code>Content-Type</code> and
+	//     <code>Content-Length</code> headers, but a 304 response may not
+	//     include a <code>Content-Length</code> which differs from the full
+	//     response's. So, write this response directly.</p>
+	app.add_header('Connection', 'close')
+	mut resp := http.Response{
+		header: app.header
+	}
+	resp.set_version(.v1_1)
+	resp.set_status(.not_modified)
+	app.conn.write_string(resp.bytestr()) or {}
+	app.done = true
+	return true
 }
 
-// <p>For JavaScript, escape any double quotes and convert newlines, so it's
-//     safe to enclose the returned string in double quotes.</p>
+// <p>For JavaScript, escape any backslashes and double quotes and convert
+//     newlines, so it's safe to enclose the returned string in double quotes.
+//     Since this string is placed inside a <code>&lt;script&gt;</code> tag,
+//     also change any <code>&lt;/</code> to <code>&lt;\/</code>, so that a
+//     <code>&lt;/script&gt;</code> in the string doesn't end the tag. The
+//     string may be an entire source file, so do all this in a single pass
+//     instead of one pass per replacement.</p>
 fn quote_string(s string) string {
-	return s.replace(r'\', r'\\').replace('"', r'\"').replace('\r\n', r'\n').replace('\r',
-		r'\n').replace('\n', r'\n')
+	mut quoted := strings.new_builder(s.len + s.len / 8)
+	for i, c in s {
+		match c {
+			`\\` {
+				quoted.write_string(r'\\')
+			}
+			`"` {
+				quoted.write_string(r'\"')
+			}
+			`\r` {
+				quoted.write_string(r'\n')
+			}
+			`\n` {
+				// <p>The <code>\r</code> of a <code>\r\n</code> was already
+				//     converted to a newline.</p>
+				if i == 0 || s[i - 1] != `\r` {
+					quoted.write_string(r'\n')
+				}
+			}
+			`/` {
+				if i > 0 && s[i - 1] == `<` {
+					quoted.write_u8(`\\`)
+				}
+				quoted.write_u8(c)
+			}
+			else {
+				quoted.write_u8(c)
+			}
+		}
+	}
+	return quoted.str()
 }
 
-// <p>In addition to quoting strings, also split up an ending
-//     <code>&lt;/script&gt;</code> tags, since this string is placed inside a
-//     <code>&lt;script&gt;</code> tag.</p>
-fn quote_script_string(source_code string) string {
-	return (quote_string(source_code).split('</script>')).join('</scr"+"ipt>')
+// <p>Compare two strings without regard to case; this is used to sort a
+//     directory listing.</p>
+fn compare_strings_ignore_case(a &string, b &string) int {
+	return compare_strings(a.to_lower(), b.to_lower())
 }
 
-// <p>Given text, escape it so it formats correctly as HTML. This is a
-//     translation of Python's <code>html.escape</code> function.</p>
+// <p>Given text, escape it so it formats correctly as HTML, either as text or
+//     as a quoted attribute value. This is a translation of Python's
+//     <code>html.escape</code> function, done in a single pass over the
+//     text.</p>
 fn escape_html(unsafe_text string) string {
-	return unsafe_text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+	// <p>Most text (file names, for example) contains nothing to escape.</p>
+	if !unsafe_text.contains_any('&<>"\'') {
+		return unsafe_text
+	}
+	mut escaped := strings.new_builder(unsafe_text.len + 16)
+	for c in unsafe_text {
+		match c {
+			`&` {
+				escaped.write_string('&amp;')
+			}
+			`<` {
+				escaped.write_string('&lt;')
+			}
+			`>` {
+				escaped.write_string('&gt;')
+			}
+			`"` {
+				escaped.write_string('&quot;')
+			}
+			`'` {
+				escaped.write_string('&#x27;')
+			}
+			else {
+				escaped.write_u8(c)
+			}
+		}
+	}
+	return escaped.str()
 }
 
 // <h2>Main&mdash;run the webserver</h2>
 fn main() {
-	mut app := &App{}
+	mut app := &App{
+		server_start: time.now().unix
+	}
 	// <p>Serve static files in the&nbsp;<code>../client/static/</code>
 	//     subdirectory from the <code>/static</code> endpoint.</p>
 	app.mount_static_folder_at(os.resource_abs_path('../client/static'), '/static')
-	print('Open http://localhost:8080/ in a browser.\n')
-	vweb.run(app, 8080)
+	print('Open http://localhost:${port}/ in a browser.\n')
+	// <p>vweb accepts each connection then handles it on its own thread, so a
+	//     slow request (a large directory listing or source file, for example)
+	//     doesn't block other requests.</p>
+	vweb.run(app, port)
 }